@@ -3,6 +3,15 @@ from .utils import get_data, download_all
 #from .utils import list2OnehotMartix
 from .utils import make_ETL1, make_ETL3, make_ETL4, make_ETL5
 from .utils import make_ETL6, make_ETL7, make_ETL8G, make_ETL9G
+from .utils import make_ETL2, make_ETL8B, make_ETL9B
+from .export import export_ETL
+from .cache import enable_record_cache, disable_record_cache
+from .cache import clear_record_cache, record_cache_info
+from .shared import publish_shared, attach_shared, unlink_shared
+from .augment import augment_batch
+from .readahead import configure_readahead
+from .quality import inspect_dataset, inspect_images, load_exclusion_mask
+from .baseline import evaluate_dataset, evaluate_datasets
 
 __version__ = '0.1'
 __author__ = 'Shin Asakawa'
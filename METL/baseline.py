@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+'''Nearest neighbour baselines to check built datasets after every rebuild.
+
+The squared euclidean distances between test and train images are computed
+as |a|^2 - 2 a.b + |b|^2 with float32 matrix products, tile by tile over the
+test and the train images, so that memory stays bounded by
+test_block * train_block floats and BLAS uses all the cores.
+
+    'knn': k nearest neighbours (k=1 by default) with majority vote
+    'ncm': nearest class mean
+
+Example:
+    import METL as metl
+    reports = metl.evaluate_datasets(['ETL8G.npz', 'ETL9G.npz'], method='knn', k=1)
+
+or from the command line:
+
+    python -m METL.baseline ETL8G.npz ETL9G.npz
+'''
+
+import numpy as np
+
+import sys
+import time
+
+
+def _as_features(images):
+    """Flatten images to float32 vectors of ink in [0, 1] (white background)."""
+    X = np.asarray(images).reshape(len(images), -1).astype(np.float32)
+    X /= 255.
+    return 1. - X
+
+
+def _blocked_topk(X_test, X_train, k, test_block, train_block):
+    """Indices (N_test, k) of the k nearest train images of each test image."""
+    train_sq = np.einsum('ij,ij->i', X_train, X_train)
+    n_test = len(X_test)
+    nearest = np.zeros((n_test, k), dtype=np.int64)
+    for t0 in range(0, n_test, test_block):
+        A = X_test[t0:t0 + test_block]
+        best_d = np.full((len(A), k), np.inf, dtype=np.float32)
+        best_i = np.zeros((len(A), k), dtype=np.int64)
+        for r0 in range(0, len(X_train), train_block):
+            B = X_train[r0:r0 + train_block]
+            # |a|^2 is the same for all train images, so that it is left out
+            d = train_sq[r0:r0 + train_block][None, :] - 2 * A.dot(B.T)
+            if k == 1:
+                i = d.argmin(axis=1)
+                dmin = d[np.arange(len(A)), i]
+                better = dmin < best_d[:, 0]
+                best_d[better, 0] = dmin[better]
+                best_i[better, 0] = i[better] + r0
+                continue
+            kk = min(k, d.shape[1])
+            i = np.argpartition(d, kk - 1, axis=1)[:, :kk]
+            cand_d = np.concatenate([best_d, np.take_along_axis(d, i, axis=1)], axis=1)
+            cand_i = np.concatenate([best_i, i + r0], axis=1)
+            keep = np.argpartition(cand_d, k - 1, axis=1)[:, :k]
+            best_d = np.take_along_axis(cand_d, keep, axis=1)
+            best_i = np.take_along_axis(cand_i, keep, axis=1)
+        nearest[t0:t0 + len(A)] = best_i
+    return nearest
+
+
+def knn_predict(X_train, y_train, X_test, k=1, test_block=2048, train_block=16384):
+    """Predict integer labels of test images by k nearest neighbours.
+
+    Arguments:
+        X_train, X_test: float32 feature matrices, see _as_features()
+        y_train: integer labels of train images
+        k: number of neighbours: integer
+        test_block, train_block: sizes of tiles of the distance matrix
+
+    Returns:
+        y_pred: numpy array of integer labels
+    """
+    nearest = _blocked_topk(X_test, X_train, k, test_block, train_block)
+    labels = y_train[nearest]
+    if k == 1:
+        return labels[:, 0]
+    votes = np.zeros((len(X_test), y_train.max() + 1), dtype=np.int32)
+    rows = np.arange(len(X_test))
+    for m in range(k):
+        votes[rows, labels[:, m]] += 1
+    return votes.argmax(axis=1)
+
+
+def ncm_predict(X_train, y_train, X_test, test_block=2048):
+    """Predict integer labels of test images by the nearest class mean.
+
+    Arguments:
+        X_train, X_test: float32 feature matrices, see _as_features()
+        y_train: integer labels of train images
+        test_block: number of test images processed at once
+
+    Returns:
+        y_pred: numpy array of integer labels
+    """
+    n_classes = y_train.max() + 1
+    counts = np.bincount(y_train, minlength=n_classes)
+    present = counts > 0
+    # images sorted by label once, so that each present class is a contiguous run
+    X_sorted = X_train[np.argsort(y_train, kind='stable')]
+    ends = np.cumsum(counts)
+    sums = np.zeros((n_classes, X_train.shape[1]), dtype=np.float32)
+    for c in np.flatnonzero(present):
+        sums[c] = X_sorted[ends[c] - counts[c]:ends[c]].sum(axis=0)
+    means = sums / np.maximum(counts, 1)[:, None].astype(np.float32)
+    means_sq = np.einsum('ij,ij->i', means, means)
+    means_sq[~present] = np.inf  # classes without train images are never predicted
+    y_pred = np.zeros(len(X_test), dtype=np.int64)
+    for t0 in range(0, len(X_test), test_block):
+        d = means_sq[None, :] - 2 * X_test[t0:t0 + test_block].dot(means.T)
+        y_pred[t0:t0 + test_block] = d.argmin(axis=1)
+    return y_pred
+
+
+def stratified_split(y, test_size=0.2, seed=0):
+    """Return a boolean mask of test samples, test_size of each class."""
+    rng = np.random.RandomState(seed)
+    perm = rng.permutation(len(y))
+    order = perm[np.argsort(y[perm], kind='stable')]
+    counts = np.bincount(y)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    rank = np.arange(len(y)) - starts[y[order]]
+    test = np.zeros(len(y), dtype=bool)
+    test[order] = rank < np.round(counts[y[order]] * test_size)
+    return test
+
+
+def evaluate(images_train, labels_train, images_test, labels_test, method='knn',
+             k=1, test_block=2048, train_block=16384):
+    """Evaluate a nearest neighbour baseline and report accuracy per class.
+
+    Arguments:
+        images_train, images_test: numpy arrays of images (N, H, W) or (N, H * W)
+        labels_train, labels_test: lists of labels, such as JIS codes
+        method: 'knn' or 'ncm': string
+        k: number of neighbours of 'knn': integer
+        test_block, train_block: sizes of tiles of the distance matrix
+
+    Returns:
+        report: dictionary of accuracy, classes, per_class_accuracy,
+            per_class_count, and seconds
+    """
+    start = time.time()
+    classes, y = np.unique(np.concatenate([np.asarray(labels_train),
+                                           np.asarray(labels_test)]),
+                           return_inverse=True)
+    y = y.ravel()
+    y_train, y_test = y[:len(labels_train)], y[len(labels_train):]
+    X_train, X_test = _as_features(images_train), _as_features(images_test)
+    if method == 'knn':
+        y_pred = knn_predict(X_train, y_train, X_test, k=k,
+                             test_block=test_block, train_block=train_block)
+    elif method == 'ncm':
+        y_pred = ncm_predict(X_train, y_train, X_test, test_block=test_block)
+    else:
+        raise ValueError('Unknown method: {}'.format(method))
+    correct = y_pred == y_test
+    count = np.bincount(y_test, minlength=len(classes))
+    hits = np.bincount(y_test, weights=correct, minlength=len(classes))
+    per_class = np.where(count > 0, hits / np.maximum(count, 1), np.nan)
+    return {'method': method,
+            'k': k,
+            'accuracy': float(correct.mean()),
+            'classes': classes,
+            'per_class_accuracy': per_class,
+            'per_class_count': count,
+            'seconds': time.time() - start}
+
+
+def evaluate_dataset(filename, method='knn', k=1, test_size=0.2, seed=0,
+                     exclude=None, verbose=True, **kwargs):
+    """Evaluate a baseline on a dataset saved as npz (arr_0: images, arr_1: labels).
+
+    Arguments:
+        filename: npz file such as 'ETL8G.npz'
+        method, k: see evaluate()
+        test_size: fraction of test samples of each class, split by seed
+        exclude: optional boolean mask of samples to be dropped, such as the
+            one of METL.quality.load_exclusion_mask()
+        verbose: optional switch to display the report
+
+    Returns:
+        report: see evaluate()
+    """
+    with np.load(filename) as a:
+        images, labels = a['arr_0'], np.asarray(a['arr_1'])
+    if exclude is not None:
+        images, labels = images[~exclude], labels[~exclude]
+    _, y = np.unique(labels, return_inverse=True)
+    test = stratified_split(y.ravel(), test_size=test_size, seed=seed)
+    report = evaluate(images[~test], labels[~test], images[test], labels[test],
+                      method=method, k=k, **kwargs)
+    report['dataset'] = filename
+    if verbose:
+        worst = np.argsort(np.nan_to_num(report['per_class_accuracy'], nan=np.inf))[:5]
+        print('{}: {} train, {} test, {} classes, accuracy={:.4f} ({:.1f} sec)'.format(
+            filename, int((~test).sum()), int(test.sum()), len(report['classes']),
+            report['accuracy'], report['seconds']))
+        print('  worst classes: {}'.format(', '.join(
+            '{}={:.3f}'.format(report['classes'][c], report['per_class_accuracy'][c])
+            for c in worst)))
+    return report
+
+
+def evaluate_datasets(filenames, **kwargs):
+    """Evaluate a baseline on each dataset, see evaluate_dataset()."""
+    return {filename: evaluate_dataset(filename, **kwargs) for filename in filenames}
+
+
+def main():
+    filenames = sys.argv[1:] or ['ETL1.npz', 'ETL3.npz', 'ETL4.npz', 'ETL5.npz',
+                                 'ETL6.npz', 'ETL7.npz', 'ETL8G.npz', 'ETL9G.npz']
+    evaluate_datasets(filenames)
+
+
+if __name__ == "__main__":
+    # execute only if run as a script
+    main()
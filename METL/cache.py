@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+'''Cache of decoded records for the fetch_ETL_* functions.
+
+The cache is disabled by default.  Once enabled, records returned by
+fetch_ETL_Ctype, fetch_ETL_Mtype, fetch_ETL_Gtype, and fetch_ETL_Btype are
+kept in a least recently used cache which is bounded by the total number of
+bytes of the decoded images rather than by the number of entries.  Records are
+keyed on (record type, file, record number, polarity, dtype) and the
+arguments changing the decoded bytes, such as the record size.  Arrays returned
+from the cache are read-only, since they are shared between callers, while
+every caller gets its own copy of the PIL.Image, which cannot be made read-only.
+
+Example:
+    import METL as metl
+    metl.enable_record_cache(max_bytes=256 << 20)
+    data, img, jis_code, serial = metl.utils.fetch_ETL_Gtype('ETL8G/ETL8G_01', 0)
+    print(metl.record_cache_info())
+'''
+
+import numpy as np
+
+from collections import OrderedDict, namedtuple
+import functools
+import inspect
+import os
+import threading
+
+CacheInfo = namedtuple('CacheInfo',
+                       ['hits', 'misses', 'evictions', 'entries', 'nbytes', 'max_bytes'])
+
+
+def _is_image(v):
+    return hasattr(v, 'getbands') and hasattr(v, 'size')  # PIL.Image
+
+
+def _sizeof(value):
+    """Number of bytes held by the arrays and images of a fetched record."""
+    nbytes = 0
+    for v in value:
+        if isinstance(v, np.ndarray):
+            nbytes += v.nbytes
+        elif _is_image(v):
+            nbytes += v.size[0] * v.size[1] * len(v.getbands())
+    return nbytes
+
+
+def _copy_images(value):
+    """Copy the images of a cached record, so that callers cannot alter the cache."""
+    return tuple(v.copy() if _is_image(v) else v for v in value)
+
+
+def _hashable(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(value)
+    return value
+
+
+class RecordCache(object):
+    """Thread-safe LRU cache bounded by the total bytes of its entries."""
+
+    def __init__(self, max_bytes=256 << 20):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits, self.misses, self.evictions = 0, 0, 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        nbytes = _sizeof(value)
+        if nbytes > self.max_bytes:
+            return
+        for v in value:
+            if isinstance(v, np.ndarray):
+                v.flags.writeable = False
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, size) = self._entries.popitem(last=False)
+                self.nbytes -= size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+            self.hits, self.misses, self.evictions = 0, 0, 0
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.evictions,
+                             len(self._entries), self.nbytes, self.max_bytes)
+
+
+_record_cache = None
+
+
+def enable_record_cache(max_bytes=256 << 20):
+    """Enable the cache of decoded records, shared by all fetch_ETL_* functions.
+
+    Arguments:
+        max_bytes: upper bound of the total bytes of cached records: integer
+
+    Returns:
+        cache: RecordCache
+    """
+    global _record_cache
+    _record_cache = RecordCache(max_bytes)
+    return _record_cache
+
+
+def disable_record_cache():
+    global _record_cache
+    _record_cache = None
+
+
+def clear_record_cache():
+    if _record_cache is not None:
+        _record_cache.clear()
+
+
+def record_cache_info():
+    """Return hits, misses, evictions, entries, nbytes, and max_bytes of the cache."""
+    if _record_cache is None:
+        return None
+    return _record_cache.info()
+
+
+def cached_record(record_type, file_arg, record_arg, polarity_arg, dtype_arg=None,
+                  default_dtype=np.uint8, extra_args=()):
+    """Decorator to look up the records of a fetch_ETL_* function in the cache.
+
+    Arguments:
+        record_type: 'C', 'M', 'G', or 'B': string
+        file_arg, record_arg, polarity_arg, dtype_arg: names of the arguments of
+            the decorated function which identify a record. The dtype of the
+            returned array is default_dtype if dtype_arg is None.
+        extra_args: names of other arguments changing the decoded record, such
+            as rec_size and img_sizes
+    """
+    def decorator(fetch):
+        signature = inspect.signature(fetch)
+
+        @functools.wraps(fetch)
+        def wrapper(*args, **kwargs):
+            cache = _record_cache
+            if cache is None:
+                return fetch(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            a = bound.arguments
+            dtype = a[dtype_arg] if dtype_arg is not None else default_dtype
+            key = (record_type, os.path.abspath(a[file_arg]), int(a[record_arg]),
+                   bool(a[polarity_arg]), np.dtype(dtype).str,
+                   tuple(_hashable(a[arg]) for arg in extra_args))
+            value = cache.get(key)
+            if value is None:
+                value = fetch(*args, **kwargs)
+                cache.put(key, value)
+            return _copy_images(value)
+        return wrapper
+    return decorator
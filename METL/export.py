@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+'''Export of a built ETL dataset as sequentially readable shards.
+
+The records are split into train/val/test partitions which never share a
+writer and which keep the proportion of each JIS class close to the requested
+ratios.  Every partition is written as `n_shards` equally sized pairs of `.npy`
+files, one for images and one for labels, so that each worker of a distributed
+training job can read its own shard from the beginning to the end.  The
+`manifest.json` written next to the shards records the split parameters,
+the size of every shard, and the sha256 checksums of the files.
+
+Example:
+    import METL as metl
+    manifest = metl.export_ETL('ETL8G', 'ETL8G_shards', n_shards=8)
+'''
+
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+import glob
+import hashlib
+import json
+import os
+import warnings
+
+from . import utils
+
+SPLIT_NAMES = ('train', 'val', 'test')
+
+# Number of sheets written by a single writer (data set), see the tables of
+# the contents of files in METL/utils.py.  ETL8B and ETL9B are binarized from
+# the same sheets as ETL8G and ETL9G.  The other databases use one sheet per
+# writer.
+SHEETS_PER_WRITER = {'ETL8G': 10, 'ETL9G': 20, 'ETL8B': 10, 'ETL9B': 20}
+
+
+def writer_disjoint_split(writers, labels, ratios=(0.8, 0.1, 0.1), seed=0):
+    """Assign every record to a split so that no writer spans two splits.
+
+    Writers are visited from the largest to the smallest, ties broken by a
+    seeded permutation, and each one goes to the split that still lacks the
+    most samples of the classes the writer has written.  A warning is issued
+    when a split of a nonzero ratio is left without writers, which happens
+    when there are only a few writers.
+
+    Arguments:
+        writers: writer id of each record: numpy array (total_images,)
+        labels: label of each record: list or numpy array (total_images,)
+        ratios: target fraction of records of each split: tuple of floats
+        seed: seed of the random permutation of writers: integer
+
+    Returns:
+        split: index of the split of each record: numpy array (total_images,)
+    """
+    ratios = np.asarray(ratios, dtype=np.float64)
+    ratios = ratios / ratios.sum()
+    _, w_inv = np.unique(writers, return_inverse=True)
+    _, c_inv = np.unique(np.asarray(labels), return_inverse=True)
+    w_inv, c_inv = w_inv.ravel(), c_inv.ravel()
+    n_writers, n_classes = w_inv.max() + 1, c_inv.max() + 1
+
+    # counts[w, c]: number of records of class c written by writer w
+    counts = np.bincount(w_inv * n_classes + c_inv,
+                         minlength=n_writers * n_classes)
+    counts = counts.reshape(n_writers, n_classes).astype(np.float64)
+    targets = ratios[:, None] * counts.sum(axis=0)[None, :]
+    current = np.zeros_like(targets)
+
+    rng = np.random.RandomState(seed)
+    order = rng.permutation(n_writers)
+    order = order[np.argsort(-counts.sum(axis=1)[order], kind='stable')]
+    split_of_writer = np.zeros(n_writers, dtype=np.int64)
+    for w in order:
+        score = np.clip(targets - current, 0, None).dot(counts[w])
+        if score.max() <= 0:
+            score = targets.sum(axis=1) - current.sum(axis=1)
+        s = int(np.argmax(score))
+        split_of_writer[w] = s
+        current[s] += counts[w]
+    empty = [s for s in np.flatnonzero(ratios > 0)
+             if not np.any(split_of_writer == s)]
+    if empty:
+        names = [SPLIT_NAMES[s] if s < len(SPLIT_NAMES) else str(s) for s in empty]
+        warnings.warn('No writer is assigned to the {} split(s): {} writers, '
+                      'ratios {}'.format(', '.join(names), n_writers,
+                                         ', '.join('{:.3g}'.format(r) for r in ratios)))
+    return split_of_writer[w_inv]
+
+
+def _write_shard(out_dir, prefix, data, labels, idx):
+    # slicing here rather than at submission keeps the copies small and parallel
+    entry = {'n': int(len(idx))}
+    for key, arr in (('images', data[idx]), ('labels', labels[idx])):
+        filename = '{}-{}.npy'.format(prefix, key)
+        path = os.path.join(out_dir, filename)
+        np.save(path, arr)
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+        entry[key] = {'file': filename,
+                      'bytes': os.path.getsize(path),
+                      'sha256': sha.hexdigest()}
+    return entry
+
+
+def write_shards(data, labels, split, out_dir, n_shards=8, shuffle=True,
+                 seed=0, n_workers=4, verbose=True):
+    """Write each split of a dataset as `n_shards` equally sized shards.
+
+    Shards left in out_dir by an earlier export are removed first, so that
+    the directory holds only the shards of this one.
+
+    Arguments:
+        data: numpy matrix of images (total_images, TARGET_HEIGHT, TARGET_WIDTH)
+        labels: list of labels
+        split: index of the split of each record, see writer_disjoint_split()
+        out_dir: directory to which shards are written
+        n_shards: number of shards of each split: integer
+        shuffle: shuffle records before sharding them: boolean
+        seed: seed of the shuffle: integer
+        n_workers: number of shards written in parallel: integer
+        verbose: optional switch to display redundant information
+
+    Returns:
+        splits: dictionary from split name to the list of its shards
+    """
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    for name in SPLIT_NAMES:
+        for path in glob.glob(os.path.join(out_dir, '{}-*-of-*-*.npy'.format(name))):
+            os.remove(path)
+    labels = np.asarray(labels)
+    rng = np.random.RandomState(seed)
+    jobs = dict()
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        for s, name in enumerate(SPLIT_NAMES):
+            idx = np.flatnonzero(split == s)
+            if shuffle:
+                idx = idx[rng.permutation(len(idx))]
+            jobs[name] = list()
+            for i, shard in enumerate(np.array_split(idx, n_shards)):
+                prefix = '{}-{:05d}-of-{:05d}'.format(name, i, n_shards)
+                jobs[name].append(executor.submit(_write_shard, out_dir, prefix,
+                                                  data, labels, shard))
+    splits = dict()
+    for name in SPLIT_NAMES:
+        splits[name] = [job.result() for job in jobs[name]]
+        if verbose:
+            print('{}: {} records in {} shards'.format(
+                name, sum(e['n'] for e in splits[name]), len(splits[name])))
+    return splits
+
+
+def export_ETL(name, out_dir, n_shards=8, ratios=(0.8, 0.1, 0.1), seed=0,
+               n_workers=4, verbose=False):
+    """Build an ETL dataset and export it as writer disjoint shards.
+
+    Arguments:
+        name: name of the database, such as 'ETL8G': string
+        out_dir: directory to which shards and `manifest.json` are written
+        n_shards: number of shards of each split: integer
+        ratios: fraction of records of train, val, and test: tuple of floats
+        seed: seed of the split and of the shuffle: integer
+        n_workers: number of shards written in parallel: integer
+        verbose: optional switch to display the progress of the export
+
+    Returns:
+        manifest: contents of `manifest.json`: dictionary
+    """
+    files_dict = utils.ETL_FILES[name]
+    data, labels, freq = getattr(utils, 'make_' + name)(verbose=False)
+    serials, sheets = utils.read_ids_ETL(files_dict, utils.ETL_TYPES[name])
+    sheets_per_writer = SHEETS_PER_WRITER.get(name, 1)
+    writers = (sheets - sheets.min()) // sheets_per_writer
+    split = writer_disjoint_split(writers, labels, ratios=ratios, seed=seed)
+
+    manifest = {'dataset': name,
+                'seed': seed,
+                'ratios': list(ratios),
+                'sheets_per_writer': sheets_per_writer,
+                'image_shape': list(data.shape[1:]),
+                'dtype': str(data.dtype),
+                'n_writers': {n: int(len(np.unique(writers[split == s])))
+                              for s, n in enumerate(SPLIT_NAMES)},
+                'splits': write_shards(data, labels, split, out_dir,
+                                       n_shards=n_shards, seed=seed,
+                                       n_workers=n_workers, verbose=verbose)}
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+'''Detection of blank, corrupt, and duplicate samples in a built dataset.
+
+For every image, a 64 bit perceptual hash (the signs of the low frequency DCT
+coefficients against their median, as in pHash) and simple quality metrics are
+computed in batches with matrix products:
+
+    ink_ratio: fraction of pixels of the foreground
+    bbox_fill: fraction of the bounding box of the foreground covered by ink
+    bbox_area: area of the bounding box relative to the whole image
+
+Near duplicates are found by multi-index hashing: the 64 bit hashes are cut
+into substrings of 16 bits, and two hashes within Hamming distance r share at
+least one substring within distance r // 4 (pigeonhole principle).  Only
+hashes falling into the same buckets of a substring are compared, instead of
+all the pairs of images.
+
+Example:
+    import numpy as np
+    import METL as metl
+    report, exclude = metl.inspect_dataset('ETL9G.npz', index_filename='ETL9G_quality.npz')
+    a = np.load('ETL9G.npz')
+    keep = ~metl.load_exclusion_mask('ETL9G_quality.npz')
+    X, y = a['arr_0'][keep], a['arr_1'][keep]
+'''
+
+import numpy as np
+
+import itertools
+
+HASH_SIZE = 32  # images are resampled to HASH_SIZE x HASH_SIZE before the DCT
+N_TABLES = 4    # 64 bit hashes are cut into 4 substrings of 16 bits
+
+
+def _resample_matrix(n_out, n_in):
+    """Matrix (n_out, n_in) averaging the area of the input under each output pixel."""
+    edges = np.linspace(0, n_in, n_out + 1)
+    m = np.zeros((n_out, n_in), dtype=np.float32)
+    for i in range(n_out):
+        for j in range(int(edges[i]), int(np.ceil(edges[i + 1]))):
+            m[i, j] = min(edges[i + 1], j + 1) - max(edges[i], j)
+    return m / m.sum(axis=1, keepdims=True)
+
+
+def _dct_matrix(n, k):
+    """First k rows of the DCT-II matrix of size n."""
+    x = np.arange(n)
+    return np.cos(np.pi * (2 * x[None, :] + 1) * np.arange(k)[:, None] / (2 * n)).astype(np.float32)
+
+
+def _ink(images, white_background):
+    ink = images.astype(np.float32) / 255.
+    return 1 - ink if white_background else ink
+
+
+if hasattr(np, 'bitwise_count'):
+    def popcount64(x):
+        return np.bitwise_count(x).astype(np.int64)
+else:
+    _POPCOUNT8 = np.array([bin(i).count('1') for i in range(256)], dtype=np.int64)
+
+    def popcount64(x):
+        x = np.ascontiguousarray(x, dtype=np.uint64)
+        return _POPCOUNT8[x.view(np.uint8)].reshape(x.shape + (8,)).sum(axis=-1)
+
+
+def image_hashes(images, white_background=True, chunk_size=65536):
+    """Compute 64 bit perceptual hashes of images.
+
+    Arguments:
+        images: numpy array (N, H, W)
+        white_background: polarity of images: boolean
+        chunk_size: number of images processed at once
+
+    Returns:
+        hashes: numpy array of uint64 (N,)
+    """
+    n, h, w = images.shape
+    rows = _dct_matrix(HASH_SIZE, 8).dot(_resample_matrix(HASH_SIZE, h))
+    cols = _dct_matrix(HASH_SIZE, 8).dot(_resample_matrix(HASH_SIZE, w))
+    hashes = np.empty(n, dtype=np.uint64)
+    for start in range(0, n, chunk_size):
+        ink = _ink(images[start:start + chunk_size], white_background)
+        coeffs = np.matmul(np.matmul(rows, ink), cols.T).reshape(len(ink), 64)
+        median = np.median(coeffs[:, 1:], axis=1, keepdims=True)
+        bits = np.packbits(coeffs > median, axis=1)
+        hashes[start:start + len(ink)] = bits.view('>u8').ravel()
+    return hashes
+
+
+def image_quality(images, white_background=True, threshold=0.5, chunk_size=65536):
+    """Compute ink ratio, bounding box fill, and bounding box area of images.
+
+    Arguments:
+        images: numpy array (N, H, W)
+        white_background: polarity of images: boolean
+        threshold: ink level above which a pixel is foreground, in [0, 1]
+        chunk_size: number of images processed at once
+
+    Returns:
+        metrics: dictionary of numpy arrays (N,) of ink_ratio, bbox_fill, and bbox_area
+    """
+    n, h, w = images.shape
+    metrics = {k: np.zeros(n, dtype=np.float32) for k in ('ink_ratio', 'bbox_fill', 'bbox_area')}
+    for start in range(0, n, chunk_size):
+        fg = _ink(images[start:start + chunk_size], white_background) > threshold
+        count = fg.sum(axis=(1, 2))
+        any_row, any_col = fg.any(axis=2), fg.any(axis=1)
+        top, bottom = any_row.argmax(axis=1), h - any_row[:, ::-1].argmax(axis=1)
+        left, right = any_col.argmax(axis=1), w - any_col[:, ::-1].argmax(axis=1)
+        area = np.where(count > 0, (bottom - top) * (right - left), 0)
+        stop = start + len(fg)
+        metrics['ink_ratio'][start:stop] = count / float(h * w)
+        metrics['bbox_fill'][start:stop] = count / np.maximum(area, 1)
+        metrics['bbox_area'][start:stop] = area / float(h * w)
+    return metrics
+
+
+class HashIndex(object):
+    """Multi-index hashing of 64 bit hashes for Hamming distance lookups.
+
+    Each of the N_TABLES substrings of 16 bits has a table of the ids of the
+    hashes sorted by the value of the substring, so that the bucket of a value
+    is found by binary search.
+    """
+
+    def __init__(self, hashes):
+        self.hashes = np.ascontiguousarray(hashes, dtype=np.uint64)
+        self._keys, self._ids = list(), list()
+        for j in range(N_TABLES):
+            sub = self._substring(self.hashes, j)
+            order = np.argsort(sub, kind='stable')
+            self._keys.append(sub[order])
+            self._ids.append(order)
+
+    @staticmethod
+    def _substring(hashes, j):
+        bits = 64 // N_TABLES
+        return ((hashes >> np.uint64(bits * j)) & np.uint64((1 << bits) - 1)).astype(np.int64)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def query(self, h, radius=4):
+        """Return ids of the hashes within Hamming distance radius of h, and the distances."""
+        bits = 64 // N_TABLES
+        r = radius // N_TABLES
+        masks = [0] + [sum(1 << b for b in c) for k in range(1, r + 1)
+                       for c in itertools.combinations(range(bits), k)]
+        candidates = list()
+        h = np.uint64(h)
+        for j in range(N_TABLES):
+            values = self._substring(np.array([h]), j)[0] ^ np.array(masks, dtype=np.int64)
+            lo = np.searchsorted(self._keys[j], values, side='left')
+            hi = np.searchsorted(self._keys[j], values, side='right')
+            candidates.extend(self._ids[j][a:b] for a, b in zip(lo, hi) if b > a)
+        if not candidates:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        ids = np.unique(np.concatenate(candidates))
+        dist = popcount64(self.hashes[ids] ^ h)
+        keep = dist <= radius
+        return ids[keep], dist[keep]
+
+    def near_duplicate_pairs(self, radius=3, max_bucket=256):
+        """Return the pairs (i < j) of hashes within Hamming distance radius.
+
+        Pairs are searched among hashes sharing an identical substring, which
+        finds all the pairs only when radius < N_TABLES, so that a larger
+        radius raises ValueError.  Within a bucket, each hash is compared with
+        at most max_bucket following ones, which bounds the time spent on huge
+        buckets such as the ones of blank images or of a crowded class.  Pairs
+        of such truncated buckets may be missed, and the number of truncated
+        buckets is returned.
+
+        Returns:
+            i, j: numpy arrays of ids
+            dist: numpy array of Hamming distances
+            truncated: number of buckets of which not all the pairs were compared
+        """
+        if radius >= N_TABLES:
+            raise ValueError('radius must be less than {}: {}'.format(N_TABLES, radius))
+        n = len(self.hashes)
+        found = list()
+        truncated = 0
+        for j in range(N_TABLES):
+            keys, ids = self._keys[j], self._ids[j]
+            _, sizes = np.unique(keys, return_counts=True)
+            truncated += int(np.sum(sizes > max_bucket + 1))
+            for k in range(1, min(max_bucket, n - 1) + 1):
+                same = np.flatnonzero(keys[:-k] == keys[k:])
+                if len(same) == 0:
+                    break
+                a, b = ids[same], ids[same + k]
+                d = popcount64(self.hashes[a] ^ self.hashes[b])
+                close = d <= radius
+                found.append(np.minimum(a, b)[close] * n + np.maximum(a, b)[close])
+        if not found:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, empty, truncated
+        pairs = np.unique(np.concatenate(found))
+        i, j = pairs // n, pairs % n
+        return i, j, popcount64(self.hashes[i] ^ self.hashes[j]), truncated
+
+
+def inspect_images(images, labels=None, radius=3, min_ink=0.005, max_ink=0.5,
+                   max_bbox_fill=0.9, min_filled_ink=0.1, max_bucket=256,
+                   white_background=True, verbose=True):
+    """Find blank, corrupt, and duplicate images, and make an exclusion mask.
+
+    Images are excluded when they are blank (ink_ratio < min_ink), when they
+    are likely corrupt (ink_ratio > max_ink, or bbox_fill > max_bbox_fill
+    together with ink_ratio > min_filled_ink), or when they are near duplicates
+    of an earlier image.  A single straight stroke fills its bounding box but has
+    little ink, so that it is kept.
+
+    Arguments:
+        images: numpy array (N, H, W)
+        labels: list of labels, to count duplicates with different labels
+        radius: Hamming distance of near duplicates, less than N_TABLES: integer
+        min_ink, max_ink, max_bbox_fill, min_filled_ink: thresholds of quality metrics
+        max_bucket: see HashIndex.near_duplicate_pairs()
+        white_background: polarity of images: boolean
+        verbose: optional switch to display the report
+
+    Returns:
+        report: dictionary of hashes, metrics, indices of flagged images,
+            pairs of near duplicates, and the number of truncated buckets
+        exclude: numpy array of boolean (N,)
+    """
+    hashes = image_hashes(images, white_background=white_background)
+    metrics = image_quality(images, white_background=white_background)
+    blank = metrics['ink_ratio'] < min_ink
+    filled = (metrics['bbox_fill'] > max_bbox_fill) & (metrics['ink_ratio'] > min_filled_ink)
+    corrupt = ~blank & ((metrics['ink_ratio'] > max_ink) | filled)
+
+    # blank images all have nearly the same hash, and are excluded anyway
+    valid = np.flatnonzero(~blank)
+    index = HashIndex(hashes[valid])
+    i, j, dist, truncated = index.near_duplicate_pairs(radius=radius,
+                                                       max_bucket=max_bucket)
+    i, j = valid[i], valid[j]
+    duplicate = np.zeros(len(images), dtype=bool)
+    duplicate[j] = True
+
+    exclude = blank | corrupt | duplicate
+    report = {'hashes': hashes,
+              'blank': np.flatnonzero(blank),
+              'corrupt': np.flatnonzero(corrupt),
+              'duplicate_pairs': np.stack([i, j, dist], axis=1),
+              'truncated_buckets': truncated,
+              'exclude': exclude}
+    report.update(metrics)
+    if labels is not None:
+        labels = np.asarray(labels)
+        report['label_mismatch_pairs'] = int(np.sum(labels[i] != labels[j]))
+    if verbose:
+        print('images={}, blank={}, corrupt={}, duplicate pairs={}, excluded={}'.format(
+            len(images), blank.sum(), corrupt.sum(), len(i), exclude.sum()))
+        if truncated:
+            print('truncated buckets={}, some duplicate pairs may be missed'.format(truncated))
+        if labels is not None:
+            print('duplicate pairs with different labels={}'.format(
+                report['label_mismatch_pairs']))
+    return report, exclude
+
+
+def inspect_dataset(filename, index_filename=None, **kwargs):
+    """Inspect a dataset saved as npz (arr_0: images, arr_1: labels).
+
+    Arguments:
+        filename: npz file of the dataset, such as 'ETL9G.npz'
+        index_filename: npz file to which the report is saved, if given
+        kwargs: see inspect_images()
+
+    Returns:
+        report, exclude: see inspect_images()
+    """
+    with np.load(filename) as a:
+        images, labels = a['arr_0'], a['arr_1']
+    if images.ndim == 2:  # flattened images
+        size = int(np.sqrt(images.shape[1]))
+        images = images.reshape(-1, size, size)
+    report, exclude = inspect_images(images, labels, **kwargs)
+    if index_filename is not None:
+        np.savez(index_filename, **report)
+    return report, exclude
+
+
+def load_exclusion_mask(index_filename):
+    """Load the exclusion mask saved by inspect_dataset()."""
+    with np.load(index_filename) as a:
+        return a['exclude']
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+'''Large block reads of raw ETL files with readahead on background threads.
+
+Reading a raw file record by record costs one round trip to the storage per
+record, which is slow on network storage such as NFS.  The functions here read
+a file in large blocks made of whole records, keep several reads in flight on
+a thread pool, and hand the records to the decoders in order.
+
+The block size and the number of reads in flight are set for all the
+builders by configure_readahead().
+
+Example:
+    import METL as metl
+    metl.configure_readahead(block_size=32 << 20, max_in_flight=8)
+    ETL8G, ETL8G_labels, ETL8G_freq = metl.make_ETL8G()
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+BLOCK_SIZE = 16 << 20
+MAX_IN_FLIGHT = 4
+
+
+def configure_readahead(block_size=None, max_in_flight=None):
+    """Set the size of block reads in bytes and the number of reads in flight."""
+    global BLOCK_SIZE, MAX_IN_FLIGHT
+    if block_size is not None:
+        BLOCK_SIZE = block_size
+    if max_in_flight is not None:
+        MAX_IN_FLIGHT = max_in_flight
+
+
+def _pread(fd, filename, size, offset):
+    if hasattr(os, 'pread'):
+        data = os.pread(fd, size, offset)
+    else:
+        # no pread on Windows, and a duplicated descriptor shares the file
+        # position with the others, so that each read opens its own handle
+        with open(filename, 'rb') as f:
+            f.seek(offset)
+            data = f.read(size)
+    if len(data) != size:
+        raise IOError('Short read: {} bytes at {}, {} expected'.format(len(data), offset, size))
+    return data
+
+
+def iter_record_blocks(filename, rec_size, num, offset=0, block_size=None,
+                       max_in_flight=None):
+    """Read records of a file in large blocks, keeping several reads in flight.
+
+    Arguments:
+        filename: raw data file
+        rec_size: size of a record in bytes: integer
+        num: number of records to be read: integer
+        offset: position of the first record in bytes: integer
+        block_size: size of a read in bytes, rounded down to whole records
+        max_in_flight: number of reads issued ahead on background threads
+
+    Yields:
+        block: bytes of whole records, in the order of the file
+    """
+    block_size = BLOCK_SIZE if block_size is None else block_size
+    max_in_flight = MAX_IN_FLIGHT if max_in_flight is None else max_in_flight
+    per_block = max(block_size // rec_size, 1)
+    starts = list(range(0, num, per_block))
+    fd = os.open(filename, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+    try:
+        with ThreadPoolExecutor(max_workers=max(max_in_flight, 1)) as executor:
+            def submit(start):
+                count = min(per_block, num - start)
+                return executor.submit(_pread, fd, filename, count * rec_size,
+                                       offset + start * rec_size)
+
+            pending = [submit(start) for start in starts[:max_in_flight]]
+            for i in range(len(starts)):
+                block = pending.pop(0).result()
+                if i + max_in_flight < len(starts):
+                    pending.append(submit(starts[i + max_in_flight]))
+                yield block
+    finally:
+        # the executor has waited for the reads in flight
+        os.close(fd)
+
+
+def read_records(filename, rec_size, num, offset=0, block_size=None,
+                 max_in_flight=None):
+    """Yield the records of a file one by one, read by iter_record_blocks().
+
+    Yields:
+        record: bytes of rec_size
+    """
+    for block in iter_record_blocks(filename, rec_size, num, offset=offset,
+                                    block_size=block_size,
+                                    max_in_flight=max_in_flight):
+        view = memoryview(block)
+        for pos in range(0, len(block), rec_size):
+            yield view[pos:pos + rec_size]
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+'''Sharing a built dataset between processes on one host.
+
+publish_shared() loads a dataset once into `multiprocessing.shared_memory`
+blocks, and attach_shared() maps the same blocks into another process as
+read-only numpy arrays without copying them.  Data loader workers on one host
+then share a single copy of the dataset instead of each holding its own.
+
+Three blocks are made for a dataset published as `name`:
+
+    <name>-images: images (total_images, TARGET_HEIGHT, TARGET_WIDTH)
+    <name>-labels: integer labels, i.e. indices into classes (total_images,)
+    <name>-meta:   reference count, shapes and dtypes, classes, and others
+
+The blocks are reference counted.  The publisher and each attached process
+hold one reference, which is released by close(), and the blocks are
+removed when the last reference is released.  Blocks left by a crashed
+process can be removed with unlink_shared().  Requires Python 3.8 or later
+for `multiprocessing.shared_memory`, which is imported only when a dataset is
+published or attached.
+
+Example:
+    # in the main process
+    import numpy as np
+    import METL as metl
+    ds = metl.publish_shared('ETL9G', 'ETL9G.npz', dtype=np.uint8)
+
+    # in each worker
+    ds = metl.attach_shared('ETL9G')
+    X, y = ds.images, ds.labels
+    ...
+    ds.close()
+'''
+
+import numpy as np
+
+import contextlib
+import json
+import os
+import sys
+import tempfile
+import zipfile
+
+META_HEADER = 16  # reference count and length of json: 2 * int64
+CHUNK_BYTES = 64 << 20
+
+
+def _block_names(name):
+    return {k: '{}-{}'.format(name, k) for k in ('images', 'labels', 'meta')}
+
+
+def _tracker_name(shm):
+    """Name of a block known to the resource tracker, which is used on POSIX only."""
+    return '/' + shm.name
+
+
+def _open_block(name, create=False, size=0):
+    """Open a block which is not removed by the resource tracker at exit."""
+    from multiprocessing import shared_memory
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, create=create, size=size,
+                                          track=False)
+    shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+    if os.name == 'posix':
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(_tracker_name(shm), 'shared_memory')
+    return shm
+
+
+def _unlink_block(shm):
+    if sys.version_info < (3, 13) and os.name == 'posix':
+        # unlink() unregisters the block from the resource tracker by itself
+        from multiprocessing import resource_tracker
+        resource_tracker.register(_tracker_name(shm), 'shared_memory')
+    shm.unlink()
+
+
+@contextlib.contextmanager
+def _locked(name):
+    path = os.path.join(tempfile.gettempdir(), 'METL-{}.lock'.format(name))
+    with open(path, 'a+') as f:
+        try:
+            import fcntl
+        except ImportError:  # Windows
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            return
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _read_npz_images(filename, member, dtype, allocate):
+    """Copy an array of a npz file into a buffer from allocate(shape, dtype).
+
+    The array is read chunk by chunk, so that it is never held twice in memory.
+    """
+    with zipfile.ZipFile(filename) as zf:
+        with zf.open(member + '.npy') as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, src_dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, src_dtype = np.lib.format.read_array_header_2_0(f)
+            assert not fortran_order, 'Fortran ordered arrays are not supported'
+            dst = allocate(shape, src_dtype if dtype is None else np.dtype(dtype))
+            rows = dst.reshape(shape[0], -1) if len(shape) > 0 else dst.reshape(1, -1)
+            row_bytes = max(rows.shape[1] * src_dtype.itemsize, 1)
+            step = max(CHUNK_BYTES // row_bytes, 1)
+            for start in range(0, len(rows), step):
+                stop = min(start + step, len(rows))
+                buf = f.read((stop - start) * row_bytes)
+                rows[start:stop] = np.frombuffer(buf, dtype=src_dtype).reshape(stop - start, -1)
+    return dst
+
+
+class SharedDataset(object):
+    """A dataset in shared memory blocks, see publish_shared() and attach_shared().
+
+    Attributes:
+        images: numpy array (total_images, TARGET_HEIGHT, TARGET_WIDTH)
+        labels: numpy array of integer labels (total_images,)
+        classes: numpy array of the original labels, such as JIS codes
+        meta: dictionary of shapes, dtypes, and the source of the dataset
+    """
+
+    def __init__(self, name, blocks, meta):
+        self.name = name
+        self._blocks = blocks
+        self.meta = meta
+        self.classes = np.array(meta['classes'])
+        for key in ('images', 'labels'):
+            arr = np.ndarray(meta[key]['shape'], dtype=np.dtype(meta[key]['dtype']),
+                             buffer=blocks[key].buf)
+            arr.flags.writeable = False
+            setattr(self, key, arr)
+
+    def close(self):
+        """Release the reference to the blocks, and remove them if it is the last one.
+
+        Arrays of this dataset must not be used after close().
+        """
+        if self._blocks is None:
+            return
+        self.images, self.labels = None, None
+        with _locked(self.name):
+            refcount = np.ndarray((2,), dtype=np.int64, buffer=self._blocks['meta'].buf)
+            refcount[0] -= 1
+            last = refcount[0] <= 0
+            del refcount
+            if last:
+                for shm in self._blocks.values():
+                    _unlink_block(shm)
+        for shm in self._blocks.values():
+            try:
+                shm.close()
+            except BufferError:  # a view is still alive, unmapped at exit
+                pass
+        self._blocks = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.meta['images']['shape'][0]
+
+
+def publish_shared(name, filename=None, data=None, labels=None, dtype=None):
+    """Load a built dataset once into shared memory blocks.
+
+    Either filename of a npz file saved by main() (arr_0: images, arr_1:
+    labels), or data and labels returned by the make_ETL* functions are given.
+
+    Arguments:
+        name: name of the blocks, used by attach_shared(): string
+        filename: npz file of the dataset, name + '.npz' by default
+        data: numpy matrix of images, instead of filename
+        labels: list of labels, instead of filename
+        dtype: dtype of shared images, such as np.uint8, the original by default
+
+    Returns:
+        dataset: SharedDataset, which holds the first reference to the blocks
+    """
+    names = _block_names(name)
+    blocks = dict()
+
+    def allocate(shape, dt):
+        size = int(np.prod(shape)) * dt.itemsize
+        blocks['images'] = _open_block(names['images'], create=True, size=max(size, 1))
+        return np.ndarray(shape, dtype=dt, buffer=blocks['images'].buf)
+
+    try:
+        if data is None:
+            if filename is None:
+                filename = name + '.npz'
+            images = _read_npz_images(filename, 'arr_0', dtype, allocate)
+            with np.load(filename) as a:
+                labels = a['arr_1']
+        else:
+            images = allocate(data.shape, data.dtype if dtype is None else np.dtype(dtype))
+            images[...] = data
+        classes, int_labels = np.unique(np.asarray(labels), return_inverse=True)
+        int_labels = int_labels.ravel().astype(np.int32)
+        blocks['labels'] = _open_block(names['labels'], create=True,
+                                       size=max(int_labels.nbytes, 1))
+        np.ndarray(int_labels.shape, dtype=np.int32,
+                   buffer=blocks['labels'].buf)[...] = int_labels
+
+        meta = {'source': filename,
+                'images': {'shape': list(images.shape), 'dtype': images.dtype.str},
+                'labels': {'shape': list(int_labels.shape), 'dtype': int_labels.dtype.str},
+                'classes': classes.tolist()}
+        del images
+        encoded = json.dumps(meta).encode('utf-8')
+        blocks['meta'] = _open_block(names['meta'], create=True,
+                                     size=META_HEADER + len(encoded))
+        header = np.ndarray((2,), dtype=np.int64, buffer=blocks['meta'].buf)
+        header[:] = (1, len(encoded))
+        del header
+        blocks['meta'].buf[META_HEADER:META_HEADER + len(encoded)] = encoded
+    except BaseException:
+        for shm in blocks.values():
+            _unlink_block(shm)
+        raise
+    return SharedDataset(name, blocks, meta)
+
+
+def attach_shared(name):
+    """Attach to a dataset published by publish_shared() as zero-copy views.
+
+    Arguments:
+        name: name given to publish_shared(): string
+
+    Returns:
+        dataset: SharedDataset, to be closed by close() when no longer used
+    """
+    names = _block_names(name)
+    with _locked(name):
+        blocks = {'meta': _open_block(names['meta'])}
+        header = np.ndarray((2,), dtype=np.int64, buffer=blocks['meta'].buf)
+        if header[0] <= 0:
+            del header
+            blocks['meta'].close()
+            raise FileNotFoundError('Shared dataset {} is being removed'.format(name))
+        header[0] += 1
+        length = int(header[1])
+        del header
+        for key in ('images', 'labels'):
+            blocks[key] = _open_block(names[key])
+    meta = json.loads(bytes(blocks['meta'].buf[META_HEADER:META_HEADER + length]).decode('utf-8'))
+    return SharedDataset(name, blocks, meta)
+
+
+def unlink_shared(name):
+    """Remove the blocks of a published dataset regardless of its references."""
+    for block_name in _block_names(name).values():
+        try:
+            shm = _open_block(block_name)
+        except FileNotFoundError:
+            continue
+        shm.close()
+        _unlink_block(shm)
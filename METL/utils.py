@@ -7,6 +7,9 @@ Reference:
 - http://etlcdb.db.aist.go.jp/etlcdb/etln/form_c.htm
 - http://etlcdb.db.aist.go.jp/etlcdb/etln/form_e8g.htm
 - http://etlcdb.db.aist.go.jp/etlcdb/etln/form_e9g.htm
+- http://etlcdb.db.aist.go.jp/etlcdb/etln/form_e8b.htm
+- http://etlcdb.db.aist.go.jp/etlcdb/etln/form_e9b.htm
+- http://etlcdb.db.aist.go.jp/etlcdb/etln/form_e2.htm
 
 /---[form_m.htm 2001-09.04]-------------------------------------------------------------------
 
@@ -227,6 +230,69 @@ app. Contents of Files
 
 ------------------------------------------------------------[form_e9g.htm]-------------------/
 
+/---[form_e8b.htm, form_e9b.htm]--------------------------------------------------------------
+
+                                B-type Data Format      (ETL8B, ETL9B)
+
+1. File Format (Fixed Record Length without Control Words)
+
+   Logical record: 512 bytes (ETL8B), 576 bytes (ETL9B)
+   The first record of each file is a dummy and does not contain a sample.
+
+2. Contents of Logical Record
+
+ --------------------------------------------------------------------------------------------
+|     Byte    |Number|  Type  |            Contents of Logical Record                        |
+|   Position  | Bytes|        |                                                              |
+|============================================================================================|
+|    1 -    2 |    2 | Integer| Serial Sheet Number (greater than or equal to 1)             |
+|    3 -    4 |    2 | Binary | JIS Kanji Code (JIS X 0208)                                  |
+|    5 -    8 |    4 | ASCII  | JIS Typical Reading ( ex. "AI.M" )                           |
+|    9 -  512 |  504 | Packed | Binary Image Data (1bit/pixel, 1=black)                      |
+|             |      |        | 64(X-axis size) * 63(Y-axis size) = 4032 pixels              |
+|  513 -  576 |   64 |        | (uncertain, ETL9B only)                                      |
+ --------------------------------------------------------------------------------------------
+
+app. Contents of Files
+
+   ETL8B/ETL8B2C1: 51200, ETL8B/ETL8B2C2: 51200, ETL8B/ETL8B2C3: 50560 records
+   ETL9B/ETL9B_1 - ETL9B/ETL9B_5: 121440 records each
+
+---------------------------------------------------------------------[form_e8b, form_e9b]----/
+
+/---[form_e2.htm]-----------------------------------------------------------------------------
+
+                                ETL2 Data Format
+
+1. File Format (Fixed Record Length without Control Words)
+
+   Logical record: 3660 characters = 2745 bytes (1character = 6bits)
+
+2. Contents of Logical Record
+
+ --------------------------------------------------------------------------------------------
+|   Character |No. of|  Type  |            Contents of Logical Record                        |
+|   Position  |Chars |        |                                                              |
+|============================================================================================|
+|    1 -    6 |    6 | Integer| Serial Data Number                                           |
+|    7 -    8 |    2 | CO-59  | Mark of Style                                                |
+|    9 -   14 |    6 | T56    | Contents ( ex. "AN1", "KAN" )                                |
+|   15 -   18 |    4 | CO-59  | Character Code (CO-59, two 12 bit values)                    |
+|   19 -   60 |   42 |        | Others (not used here)                                       |
+|-------------|------|--------|--------------------------------------------------------------|
+|   61 - 3660 | 3600 | Packed | 64 Gray Level (6bit/pixel) Image Data                        |
+|             |      |        | 60(X-axis size) * 60(Y-axis size) = 3600 pixels              |
+ --------------------------------------------------------------------------------------------
+
+app. Contents of Files
+
+   ETL2/ETL2_1: 9056, ETL2/ETL2_2: 10480, ETL2/ETL2_3: 11360,
+   ETL2/ETL2_4: 10480, ETL2/ETL2_5: 11420 records
+
+   ETL2 consists of printed characters, so that there is no writer nor sheet.
+
+------------------------------------------------------------------------------[form_e2.htm]---/
+
 
 # Memorandom
 
@@ -290,6 +356,13 @@ import struct
 import sys
 from urllib import request
 
+try:
+    from .cache import cached_record
+    from .readahead import iter_record_blocks, read_records
+except ImportError:  # run as a script
+    from cache import cached_record
+    from readahead import iter_record_blocks, read_records
+
 #Belows are required to manage zip files in memory
 #See https://stackoverflow.com/questions/10908877/extracting-a-zipfile-to-memory
 #import zipfile
@@ -350,88 +423,205 @@ def download_all():
 
 
 #----------------------------------------------------------------------------
+# Raw data files of each ETL database and the number of records in each file
+ETL_FILES = {
+    'ETL1': {'ETL1/ETL1C_01':11560,
+             'ETL1/ETL1C_02':11560,
+             'ETL1/ETL1C_03':11560,
+             'ETL1/ETL1C_04':11560,
+             'ETL1/ETL1C_05':11560,
+             'ETL1/ETL1C_06':11560,
+             'ETL1/ETL1C_07':11288,
+             'ETL1/ETL1C_08':11288,
+             'ETL1/ETL1C_09':11287,
+             'ETL1/ETL1C_10':11288,
+             'ETL1/ETL1C_11':11288,
+             'ETL1/ETL1C_12':11287,
+             'ETL1/ETL1C_13':4233},
+    'ETL3': {'ETL3/ETL3C_1':4792,
+             'ETL3/ETL3C_2':4792},
+    'ETL4': {'ETL4/ETL4C':6112},
+    'ETL5': {'ETL5/ETL5C':6120},
+    'ETL6': {'ETL6/ETL6C_01':13800,
+             'ETL6/ETL6C_02':13800,
+             'ETL6/ETL6C_03':13800,
+             'ETL6/ETL6C_04':13800,
+             'ETL6/ETL6C_05':13800,
+             'ETL6/ETL6C_06':13800,
+             'ETL6/ETL6C_07':13800,
+             'ETL6/ETL6C_08':13800,
+             'ETL6/ETL6C_09':13800,
+             'ETL6/ETL6C_10':13800,
+             'ETL6/ETL6C_11':13800,
+             'ETL6/ETL6C_12':6915},
+    'ETL7': {'ETL7/ETL7LC_1':9600,
+             'ETL7/ETL7LC_2':7200,
+             'ETL7/ETL7SC_1':9600,
+             'ETL7/ETL7SC_2':7200},
+}
+ETL_FILES['ETL8G'] = {'ETL8G/ETL8G_{:02d}'.format(i+1):4780 for i in range(32)}
+ETL_FILES['ETL8G']['ETL8G/ETL8G_33'] = 956
+ETL_FILES['ETL9G'] = {'ETL9G/ETL9G_{:02d}'.format(i+1):12144 for i in range(50)}
+ETL_FILES['ETL2'] = {'ETL2/ETL2_1':9056,
+                     'ETL2/ETL2_2':10480,
+                     'ETL2/ETL2_3':11360,
+                     'ETL2/ETL2_4':10480,
+                     'ETL2/ETL2_5':11420}
+ETL_FILES['ETL8B'] = {'ETL8B/ETL8B2C1':51200,
+                      'ETL8B/ETL8B2C2':51200,
+                      'ETL8B/ETL8B2C3':50560}
+ETL_FILES['ETL9B'] = {'ETL9B/ETL9B_{:d}'.format(i+1):121440 for i in range(5)}
+
+# Record format of each ETL database. 'B8' and 'B9' are the B-type formats
+# of ETL8B and ETL9B, which differ only in their record sizes.
+ETL_TYPES = {'ETL1': 'M', 'ETL2': 'ETL2', 'ETL3': 'C', 'ETL4': 'C', 'ETL5': 'C',
+             'ETL6': 'M', 'ETL7': 'M', 'ETL8G': 'G', 'ETL9G': 'G',
+             'ETL8B': 'B8', 'ETL9B': 'B9'}
+ETL_Btype_rec_sizes = {'B8': 512, 'B9': 576}
+
+
 def make_ETL1(verbose=True):
-    ETL1_files = {'ETL1/ETL1C_01':11560, 
-                  'ETL1/ETL1C_02':11560,
-                  'ETL1/ETL1C_03':11560,
-                  'ETL1/ETL1C_04':11560,
-                  'ETL1/ETL1C_05':11560,
-                  'ETL1/ETL1C_06':11560,
-                  'ETL1/ETL1C_07':11288,
-                  'ETL1/ETL1C_08':11288,
-                  'ETL1/ETL1C_09':11287,
-                  'ETL1/ETL1C_10':11288,
-                  'ETL1/ETL1C_11':11288,
-                  'ETL1/ETL1C_12':11287,
-                  'ETL1/ETL1C_13':4233}
+    ETL1_files = ETL_FILES['ETL1']
     ETL1, ETL1_labels, ETL1_freq, is_ok = make_data_ETL_Mtype(ETL1_files,verbose=verbose)
     return ETL1, ETL1_labels, ETL1_freq
 
 
+def make_ETL2(verbose=True):
+    ETL2_files = ETL_FILES['ETL2']
+    ETL2, ETL2_labels, ETL2_freq, is_ok = make_data_ETL2(ETL2_files, verbose=verbose)
+    return ETL2, ETL2_labels, ETL2_freq
+
+
 def make_ETL3(verbose=True):
-    ETL3_files = {'ETL3/ETL3C_1':4792, 
-                  'ETL3/ETL3C_2':4792}
-    ETL3, ETL3_labels, ETL3_freq, is_ok = make_data_ETL_Ctype(ETL3_files)
+    ETL3_files = ETL_FILES['ETL3']
+    ETL3, ETL3_labels, ETL3_freq, is_ok = make_data_ETL_Ctype(ETL3_files, verbose=verbose)
     #data, img, jis_code, serial_number = fetch_ETL_Ctype(filename, 4792, white_background=True)
     return ETL3, ETL3_labels, ETL3_freq
 
 
 def make_ETL4(verbose=True):
-    ETL4_files = {'ETL4/ETL4C':6112}
-    ETL4, ETL4_labels, ETL4_freq, is_ok = make_data_ETL_Ctype(ETL4_files)
+    ETL4_files = ETL_FILES['ETL4']
+    ETL4, ETL4_labels, ETL4_freq, is_ok = make_data_ETL_Ctype(ETL4_files, verbose=verbose)
     return ETL4, ETL4_labels, ETL4_freq
 
 
 def make_ETL5(verbose=True):
-    ETL5_files = {'ETL5/ETL5C':6120}
-    ETL5, ETL5_labels, ETL5_freq, is_ok = make_data_ETL_Ctype(ETL5_files)
+    ETL5_files = ETL_FILES['ETL5']
+    ETL5, ETL5_labels, ETL5_freq, is_ok = make_data_ETL_Ctype(ETL5_files, verbose=verbose)
     return ETL5, ETL5_labels, ETL5_freq
 
     
 def make_ETL6(verbose=True):
-    ETL6_files = {'ETL6/ETL6C_01':13800, 
-                  'ETL6/ETL6C_02':13800,
-                  'ETL6/ETL6C_03':13800,
-                  'ETL6/ETL6C_04':13800,
-                  'ETL6/ETL6C_05':13800,
-                  'ETL6/ETL6C_06':13800,
-                  'ETL6/ETL6C_07':13800,
-                  'ETL6/ETL6C_08':13800,
-                  'ETL6/ETL6C_09':13800,
-                  'ETL6/ETL6C_10':13800,
-                  'ETL6/ETL6C_11':13800,
-                  'ETL6/ETL6C_12':6915}
+    ETL6_files = ETL_FILES['ETL6']
     #ETL6_total_images = np.sum([ETL6_files[i] for i in ETL6_files])
     ETL6, ETL6_labels, ETL6_freq, is_ok = make_data_ETL_Mtype(ETL6_files,verbose=verbose)
     return ETL6, ETL6_labels, ETL6_freq
 
 
 def make_ETL7(verbose=True):
-    ETL7_files = {'ETL7/ETL7LC_1':9600, 
-                  'ETL7/ETL7LC_2':7200, 
-                  'ETL7/ETL7SC_1':9600, 
-                  'ETL7/ETL7SC_2':7200}
+    ETL7_files = ETL_FILES['ETL7']
     #ETL7_total_images = np.sum([ETL7_files[i] for i in ETL7_files])
     ETL7, ETL7_labels, ETL7_freq, is_ok = make_data_ETL_Mtype(ETL7_files, verbose=verbose)
     return ETL7, ETL7_labels, ETL7_freq
 
 def make_ETL8G(verbose=True):
-    ETL8G_filenames = ['ETL8G/ETL8G_{:02d}'.format(i+1) for i in range(32)]
-    ETL8G_files = {f:4780 for f in ETL8G_filenames}
-    ETL8G_files['ETL8G/ETL8G_33'] = 956
+    ETL8G_files = ETL_FILES['ETL8G']
     ETL8G, ETL8G_labels, ETL8G_freq, is_ok = make_data_ETL_Gtype(ETL8G_files,verbose=verbose)
     return ETL8G, ETL8G_labels, ETL8G_freq
 
 
 def make_ETL9G(verbose=True):
-    ETL9G_filenames = ['ETL9G/ETL9G_{:02d}'.format(i+1) for i in range(50)]
-    ETL9G_files = {f:12144 for f in ETL9G_filenames}
+    ETL9G_files = ETL_FILES['ETL9G']
     ETL9G, ETL9G_labels, ETL9G_freq, is_of = make_data_ETL_Gtype(ETL9G_files,verbose=verbose)
     return ETL9G, ETL9G_labels, ETL9G_freq
 
 
+def make_ETL8B(verbose=True):
+    ETL8B_files = ETL_FILES['ETL8B']
+    ETL8B, ETL8B_labels, ETL8B_freq, is_ok = make_data_ETL_Btype(ETL8B_files,
+                                                                 rec_size=512,
+                                                                 verbose=verbose)
+    return ETL8B, ETL8B_labels, ETL8B_freq
+
+
+def make_ETL9B(verbose=True):
+    ETL9B_files = ETL_FILES['ETL9B']
+    ETL9B, ETL9B_labels, ETL9B_freq, is_ok = make_data_ETL_Btype(ETL9B_files,
+                                                                 rec_size=576,
+                                                                 verbose=verbose)
+    return ETL9B, ETL9B_labels, ETL9B_freq
+
+
+#----------------------------------------------------------------------------
+# Record headers
+# Serial sheet and data numbers of byte aligned records (M and G type)
+ETL_HEADER_DTYPES = {
+    'M': np.dtype({'names': ['sheet', 'serial'],
+                   'formats': ['>u2', '>u4'],
+                   'offsets': [4, 12],
+                   'itemsize': 2052}),
+    'G': np.dtype({'names': ['sheet', 'serial'],
+                   'formats': ['>u2', '>u4'],
+                   'offsets': [0, 12],
+                   'itemsize': 8199}),
+}
+
+
+def read_ids_ETL(files_dict, record_type):
+    """Read serial data numbers and serial sheet numbers of all records at once.
+
+    Only the record headers are looked at, through a memory map, so that this
+    is much cheaper than decoding the images.
+
+    Arguments:
+        files_dict: information of data files and number of records
+        record_type: 'C', 'M', 'G', 'B8', 'B9', or 'ETL2'
+
+    Returns:
+        serials: numpy array of serial data numbers (total_images,)
+        sheets: numpy array of serial sheet numbers (total_images,)
+
+    B-type records have no serial data number, so that the position of the
+    record in its file (from 1) is returned instead.  ETL2 has no sheet
+    number, so that the serial data number is returned as the sheet number.
+    """
+    serials, sheets = list(), list()
+    for filename in files_dict:
+        num = files_dict[filename]
+        if record_type in ETL_Btype_rec_sizes:
+            rec_size = ETL_Btype_rec_sizes[record_type]
+            r = np.memmap(filename, dtype=np.uint8, mode='r', offset=rec_size,
+                          shape=(num, rec_size))
+            serials.append(np.arange(1, num + 1))
+            sheets.append((r[:, 0].astype(np.int64) << 8) | r[:, 1])
+        elif record_type == 'ETL2':
+            r = np.memmap(filename, dtype=np.uint8, mode='r', shape=(num, 2745))
+            b = r[:, :5].astype(np.uint64)
+            serial = ((b[:, 0] << 28) | (b[:, 1] << 20) | (b[:, 2] << 12) |
+                      (b[:, 3] << 4) | (b[:, 4] >> 4))
+            serials.append(serial)
+            sheets.append(serial)
+        elif record_type == 'C':
+            # The first two 36 bit words are the serial data and sheet numbers
+            r = np.memmap(filename, dtype=np.uint8, mode='r', shape=(num, 2952))
+            b = r[:, :9].astype(np.uint64)
+            serials.append((b[:, 0] << 28) | (b[:, 1] << 20) | (b[:, 2] << 12) |
+                           (b[:, 3] << 4) | (b[:, 4] >> 4))
+            sheets.append(((b[:, 4] & 0xf) << 32) | (b[:, 5] << 24) |
+                          (b[:, 6] << 16) | (b[:, 7] << 8) | b[:, 8])
+        else:
+            r = np.memmap(filename, dtype=ETL_HEADER_DTYPES[record_type],
+                          mode='r', shape=(num,))
+            serials.append(r['serial'].astype(np.int64))
+            sheets.append(r['sheet'].astype(np.int64))
+        del r
+    return (np.concatenate(serials).astype(np.int64),
+            np.concatenate(sheets).astype(np.int64))
+
+
 #----------------------------------------------------------------------------
 # Ctype
+@cached_record('C', 'f', 'pos', 'white_background', 'dtype')
 def fetch_ETL_Ctype(f,
                     pos=0,
                     dtype=np.int32,
@@ -453,9 +643,18 @@ def fetch_ETL_Ctype(f,
         serial_number: the original number for ETL: integer
     """
     rec_size = 2952
-    f = bitstring.ConstBitStream(filename=f)
-    f.bytepos = pos * rec_size
-    r = f.readlist('2*uint:36,uint:8,pad:28,uint:8,pad:28,4*uint:6,pad:12,15*uint:36,pad:1008,bytes:21888')
+    with open(f, 'rb') as fd:
+        fd.seek(pos * rec_size)
+        s = fd.read(rec_size)
+    return decode_ETL_Ctype(s, dtype=dtype, white_background=white_background,
+                            verbose=verbose)
+
+
+def decode_ETL_Ctype(s, dtype=np.int32, white_background=True, verbose=False):
+    """decode a record of ETL C-type data, see fetch_ETL_Ctype()."""
+    f = bitstring.ConstBitStream(bytes=bytes(s))
+    # 216 bytes of header, and 72 * 76 pixels of 4 bits = 2736 bytes of image
+    r = f.readlist('2*uint:36,uint:8,pad:28,uint:8,pad:28,4*uint:6,pad:12,15*uint:36,pad:1008,bytes:2736')
     serial_number = r[0]
     jis_code = r[2]
     if verbose:
@@ -511,7 +710,7 @@ def make_data_ETL_Ctype(files_dict, target_size=TARGETSIZE, verbose=True):
     freqs, labels_list = dict(), list()
     
     #initialize image data matrix
-    total_images = np.sum(files_dict[i] for i in files_dict)
+    total_images = sum(files_dict[i] for i in files_dict)
     ret = np.ndarray((total_images, target_size[0], target_size[1]), dtype=np.int32)
     if verbose:
         print(ret.shape, ret.size)
@@ -520,17 +719,15 @@ def make_data_ETL_Ctype(files_dict, target_size=TARGETSIZE, verbose=True):
         if verbose:
             print('filename: {}'.format(filename))
         Min, Max, local_count = 255, 0, 0
-        for num in range(files_dict[filename]):
-            data, img, jis_code, serial_number = fetch_ETL_Ctype(filename, 
-                                                                 num, 
-                                                                 white_background=True)
+        for s in read_records(filename, 2952, files_dict[filename]):
+            data, img, jis_code, serial_number = decode_ETL_Ctype(s, white_background=True)
             min, max = np.min(data), np.max(data)
             white_image.paste(img, (0, 0))
-            ret_image = white_image.resize(target_size, Image.ANTIALIAS)
+            ret_image = white_image.resize(target_size, Image.LANCZOS)
             ret[counter] = ret_image
             label = str(jis_code)
             labels_list.append(label)
-            if counter % (total_images>>3) == 0 and verbose:
+            if verbose and counter % max(total_images>>3, 1) == 0:
                 plt.imshow(ret[counter],cmap='gray')
                 plt.show()
                 print('jis code={}'.format(jis_code))
@@ -562,6 +759,8 @@ def make_data_ETL_Ctype(files_dict, target_size=TARGETSIZE, verbose=True):
 
 #------------------------------------------------------------------------------
 # Mtype
+@cached_record('M', 'filename', 'num', 'WhiteBackGround', 'dtype',
+               extra_args=('rec_size', 'img_sizes'))
 def fetch_ETL_Mtype(num,
                     filename='ETL7/ETL7LC_1', 
                     rec_size=2052,            #ETL_Mtype_rec_size,
@@ -573,11 +772,20 @@ def fetch_ETL_Mtype(num,
     #ETL_Mtype_rec_size = 2052
     ETL_Mtype_rec_size = rec_size
     ETL_Mtype_img_sizes = (64, 63)            #size = (width, hight), for ETL1, 6, and 7
-    ETL_Mtype_record_format = '>H2sH6BI4H4B4x2016s4x'  # for ETL1, ETL6, and ETL7
 
     with open(filename, 'rb') as f:
         f.seek(num * rec_size)
         s = f.read(rec_size)
+    return decode_ETL_Mtype(s, img_sizes=img_sizes, WhiteBackGround=WhiteBackGround,
+                            dtype=dtype)
+
+
+def decode_ETL_Mtype(s,
+                     img_sizes=(64, 63),
+                     WhiteBackGround=True,
+                     dtype=np.int32):
+    """decode a record of ETL M-type, see fetch_ETL_Mtype()."""
+    ETL_Mtype_record_format = '>H2sH6BI4H4B4x2016s4x'  # for ETL1, ETL6, and ETL7
     r = struct.unpack(ETL_Mtype_record_format, s)
     jis_code = '{:x}'.format(r[3])
     iF = Image.frombytes('F', img_sizes, r[18], 'bit', 4)
@@ -610,7 +818,7 @@ def make_data_ETL_Mtype(files_dict, target_size=TARGETSIZE, verbose=True):
     freqs, labels_list = dict(), list()
 
     #initialize image data matrix
-    total_images = np.sum(files_dict[i] for i in files_dict)
+    total_images = sum(files_dict[i] for i in files_dict)
     ret = np.ndarray((total_images, target_size[0], target_size[1]), dtype=np.int32)
     #print(ret.shape, ret.size)
     
@@ -619,18 +827,18 @@ def make_data_ETL_Mtype(files_dict, target_size=TARGETSIZE, verbose=True):
             print(filename)
         Min, Max, local_count = 255, 0, 0
 
-        for num in range(files_dict[filename]):
-            data, img, jis_code = fetch_ETL_Mtype(num, filename, WhiteBackGround=True)
+        for s in read_records(filename, 2052, files_dict[filename]):
+            data, img, jis_code = decode_ETL_Mtype(s, WhiteBackGround=True)
             min, max = np.min(data), np.max(data)
             #white_image.paste(img, (0, 1))
             white_image.paste(img, (0, 0))
-            ret_image = white_image.resize(target_size, Image.ANTIALIAS)
+            ret_image = white_image.resize(target_size, Image.LANCZOS)
             #ret[counter] = white_image
             ret[counter] = ret_image
             label = str(jis_code)
             labels_list.append(label)
 
-            if counter % (total_images>>3) == 0 and verbose:
+            if verbose and counter % max(total_images>>3, 1) == 0:
                 plt.imshow(ret[counter], cmap='gray')
                 plt.show()
                 print('jis code={}'.format(jis_code))
@@ -665,6 +873,11 @@ def read_record_ETL_Gtype(fd, rec_size=8199, verbose=False):
     """read a recode from a file."""
     rec_size = 8199
     s = fd.read(rec_size)
+    return decode_record_ETL_Gtype(s, verbose=verbose)
+
+
+def decode_record_ETL_Gtype(s, verbose=False):
+    """decode a recode of 8199 bytes, see read_record_ETL_Gtype()."""
     r = struct.unpack('>2H8sI4B4H2B30x8128s11x', s)
     iF = Image.frombytes('F', (128, 127), r[14], 'bit', 4)
     #size = (width, hight)
@@ -690,11 +903,18 @@ def read_record_ETL_Gtype(fd, rec_size=8199, verbose=False):
     return r + (iL,)
 
 
+@cached_record('G', 'filename', 'id_record', 'white_background')
 def fetch_ETL_Gtype(filename, id_record, white_background=True, verbose=False):
     rec_size = 8199
     with open(filename, 'rb') as f:
         f.seek(id_record * rec_size)
-        r = read_record_ETL_Gtype(f)
+        s = f.read(rec_size)
+    return decode_ETL_Gtype(s, white_background=white_background)
+
+
+def decode_ETL_Gtype(s, white_background=True):
+    """decode a record of ETL G-type, see fetch_ETL_Gtype()."""
+    r = decode_record_ETL_Gtype(s)
     serial, jis_code = r[0], r[1]
     if white_background:
         iE = Image.eval(r[-1], lambda x: 255-x*16)  # Background: white, and foreground: black
@@ -725,26 +945,27 @@ def make_data_ETL_Gtype(files_dict, target_size=TARGETSIZE, verbose=True):
     freqs, labels_list = dict(), list()
 
     #initialize image data matrix
-    total_images = np.sum(files_dict[i] for i in files_dict)
+    total_images = sum(files_dict[i] for i in files_dict)
     ret = np.ndarray((total_images, target_size[0], target_size[1]), dtype=np.int32)
-    print(ret.shape, ret.size)
+    if verbose:
+        print(ret.shape, ret.size)
     
     for filename in files_dict:
         if verbose:
             print(filename)
         Min, Max = 255, 0
         local_count = 0
-        for num in range(files_dict[filename]):
-            data, img, jis_code, serial = fetch_ETL_Gtype(filename, num, white_background=True)
+        for s in read_records(filename, 8199, files_dict[filename]):
+            data, img, jis_code, serial = decode_ETL_Gtype(s, white_background=True)
             white_image.paste(img, (0, 1))
             
-            ret_image = white_image.resize(target_size, Image.ANTIALIAS)
+            ret_image = white_image.resize(target_size, Image.LANCZOS)
             ret[counter] = ret_image
             min, max = np.min(data), np.max(data)
         
             label = str(jis_code)
             labels_list.append(label)
-            if counter % (total_images>>3) == 0 and verbose:
+            if verbose and counter % max(total_images>>3, 1) == 0:
                 plt.imshow(ret[counter],cmap='gray')
                 plt.show()
                 print('jis code={}'.format(jis_code))
@@ -772,6 +993,176 @@ def make_data_ETL_Gtype(files_dict, target_size=TARGETSIZE, verbose=True):
             print('counter={}'.format(counter))
     return ret, labels_list, freqs, counter == total_images
 
+
+#------------------------------------------------------------------------------
+# Btype (ETL8B and ETL9B) and ETL2
+def decode_ETL_Btype(records, white_background=True):
+    """Decode B-type records of ETL8B and ETL9B at once.
+
+    Arguments:
+        records: raw records: numpy array of uint8 (num, rec_size)
+        white_background: optional switch to be reversed the polarity: boolean
+
+    Returns:
+        images: numpy array of uint8 (num, 63, 64)
+        jis_codes: numpy array of JIS X 0208 codes (num,)
+        sheets: numpy array of serial sheet numbers (num,)
+    """
+    sheets = (records[:, 0].astype(np.int64) << 8) | records[:, 1]
+    jis_codes = (records[:, 2].astype(np.int64) << 8) | records[:, 3]
+    bits = np.unpackbits(records[:, 8:512], axis=1).reshape(-1, 63, 64)
+    if white_background:
+        images = (1 - bits) * 255  # Background: white, and foreground: black
+    else:
+        images = bits * 255  # background: black, and foreground: white
+    return images.astype(np.uint8), jis_codes, sheets
+
+
+@cached_record('B', 'filename', 'id_record', 'white_background',
+               extra_args=('rec_size',))
+def fetch_ETL_Btype(filename, id_record, rec_size=512, white_background=True):
+    """read an image from ETL B-type data such as ETL8B (rec_size=512) and ETL9B (rec_size=576).
+
+    The dummy record at the head of the file is skipped, so that id_record
+    starts from 0 for the first sample.
+    """
+    with open(filename, 'rb') as f:
+        f.seek((id_record + 1) * rec_size)
+        s = f.read(rec_size)
+    images, jis_codes, sheets = decode_ETL_Btype(
+        np.frombuffer(s, dtype=np.uint8).reshape(1, rec_size), white_background)
+    img = Image.fromarray(images[0])
+    return np.asarray(img), img, jis_codes[0], sheets[0]
+
+
+def decode_ETL2(records, white_background=True):
+    """Decode records of ETL2 at once.
+
+    Arguments:
+        records: raw records: numpy array of uint8 (num, 2745)
+        white_background: optional switch to be reversed the polarity: boolean
+
+    Returns:
+        images: numpy array of uint8 (num, 60, 60)
+        co59_codes: numpy array of CO-59 codes, the two 12 bit values joined
+            into a 24 bit integer (num,)
+        serials: numpy array of serial data numbers (num,)
+    """
+    # 3660 characters of 6 bits
+    bits = np.unpackbits(records, axis=1).reshape(len(records), 3660, 6)
+    chars = bits.dot(np.array([32, 16, 8, 4, 2, 1], dtype=np.int64))
+    serials = np.zeros(len(records), dtype=np.int64)
+    for i in range(6):
+        serials = (serials << 6) | chars[:, i]
+    # characters 15 - 18 hold the CO-59 code as two 12 bit values
+    co59_codes = ((((chars[:, 14] << 6) | chars[:, 15]) << 12) |
+                  (chars[:, 16] << 6) | chars[:, 17])
+    levels = chars[:, 60:].reshape(-1, 60, 60)
+    if white_background:
+        images = 255 - levels * 4  # Background: white, and foreground: black
+    else:
+        images = levels * 4  # background: black, and foreground: white
+    return images.astype(np.uint8), co59_codes, serials
+
+
+def _make_data_from_records(files_dict, rec_size, decode, offset=0,
+                            target_size=TARGETSIZE, chunk_size=1024, verbose=True):
+    """Resize images decoded chunk by chunk in the same way as the other builders.
+
+    Arguments:
+        files_dict: information of data files and number of records
+        rec_size: size of a record in bytes
+        decode: function (records) -> (images, codes), where records are
+            numpy array of uint8 (num, rec_size)
+        offset: position of the first record in bytes
+        target_size: size of returned images
+        chunk_size: number of records decoded at once
+        verbose: optional switch to display redundant information
+
+    Returns:
+        ret: numpy matrix of images (total_images, TARGET_HEIGHT, TARGET_WIDTH)
+        labels_list: list of labels
+        labels_freq: frequncy tables of labels
+    """
+    counter = 0
+    freqs, labels_list = dict(), list()
+    total_images = sum(files_dict[i] for i in files_dict)
+    ret = np.ndarray((total_images, target_size[0], target_size[1]), dtype=np.int32)
+    if verbose:
+        print(ret.shape, ret.size)
+
+    for filename in files_dict:
+        if verbose:
+            print(filename)
+        local_count = 0
+        for block in iter_record_blocks(filename, rec_size, files_dict[filename],
+                                        offset=offset):
+            records = np.frombuffer(block, dtype=np.uint8).reshape(-1, rec_size)
+            for start in range(0, len(records), chunk_size):
+                images, codes = decode(records[start:start + chunk_size])
+                for image, code in zip(images, codes):
+                    ret_image = Image.fromarray(image).resize(target_size, Image.LANCZOS)
+                    ret[counter] = ret_image
+                    label = str(code)
+                    labels_list.append(label)
+                    counter += 1
+                    local_count += 1
+                    if label in freqs:
+                        freqs[label] += 1
+                    else:
+                        freqs[label] = 1
+        if verbose:
+            print('filename={:s}, '.format(filename), end='')
+            print('record numbers={:d}, '.format(files_dict[filename]), end='')
+            print('local_count={:d}'.format(local_count))
+    if verbose:
+        print('counter={}'.format(counter))
+    return ret, labels_list, freqs, counter == total_images
+
+
+def make_data_ETL_Btype(files_dict, rec_size=512, target_size=TARGETSIZE, verbose=True):
+    """Read ETL B-type data such as ETL8B and ETL9B and return numpy matrix and so on.
+
+    Records are decoded chunk by chunk with np.unpackbits.
+
+    Arguments:
+        files_dict: information of data files and number of records
+        rec_size: 512 for ETL8B, and 576 for ETL9B
+
+    Returns:
+        ret: numpy matrix of images (total_images, TARGET_HEIGHT, TARGET_WIDTH)
+        labels_list: list of labels
+        labels_freq: frequncy tables of labels
+    """
+    def decode(records):
+        images, jis_codes, sheets = decode_ETL_Btype(records)
+        return images, jis_codes
+
+    # skip the dummy record at the head of each file
+    return _make_data_from_records(files_dict, rec_size, decode, offset=rec_size,
+                                   target_size=target_size, verbose=verbose)
+
+
+def make_data_ETL2(files_dict, target_size=TARGETSIZE, verbose=True):
+    """Read ETL2 data and return numpy matrix and so on.
+
+    Labels are the CO-59 codes of the records.
+
+    Arguments:
+        files_dict: information of data files and number of records
+
+    Returns:
+        ret: numpy matrix of images (total_images, TARGET_HEIGHT, TARGET_WIDTH)
+        labels_list: list of labels
+        labels_freq: frequncy tables of labels
+    """
+    def decode(records):
+        images, co59_codes, serials = decode_ETL2(records)
+        return images, co59_codes
+
+    return _make_data_from_records(files_dict, 2745, decode,
+                                   target_size=target_size, verbose=verbose)
+
 #-----------------------------------------------------------------------------
 
 
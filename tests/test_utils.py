@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+'''Regression checks of the bit level decoders against synthetic records.
+
+Known fields and pixels are packed into records laid out as described in the
+data formats of METL/utils.py, and the decoders must give them back.
+'''
+
+import numpy as np
+
+from METL import utils
+
+
+def pack_bits(values, width):
+    """Pack unsigned integers of `width` bits each into bytes, big endian."""
+    values = np.asarray(values, dtype=np.uint64)
+    shifts = np.arange(width - 1, -1, -1, dtype=np.uint64)
+    bits = ((values[:, None] >> shifts) & np.uint64(1)).astype(np.uint8)
+    return np.packbits(bits.ravel()).tobytes()
+
+
+def make_Btype_record(sheet, jis_code, pixels, rec_size):
+    header = bytes([sheet >> 8, sheet & 0xff, jis_code >> 8, jis_code & 0xff]) + b'ABCD'
+    image = np.packbits(pixels.ravel()).tobytes()
+    return header + image + bytes(rec_size - 8 - len(image))
+
+
+def make_ETL2_record(serial, co59, levels):
+    chars = np.zeros(3660, dtype=np.int64)
+    for i in range(6):
+        chars[i] = (serial >> (6 * (5 - i))) & 0x3f
+    chars[14:18] = [co59[0] >> 6, co59[0] & 0x3f, co59[1] >> 6, co59[1] & 0x3f]
+    chars[60:] = levels.ravel()
+    return pack_bits(chars, 6)
+
+
+def test_decode_ETL_Btype():
+    rng = np.random.RandomState(0)
+    for rec_size in (512, 576):
+        pixels = rng.randint(0, 2, (2, 63, 64)).astype(np.uint8)
+        records = b''.join(make_Btype_record(sheet, jis_code, p, rec_size)
+                           for sheet, jis_code, p in [(1234, 0x3021, pixels[0]),
+                                                      (1235, 0x4f53, pixels[1])])
+        records = np.frombuffer(records, dtype=np.uint8).reshape(2, rec_size)
+        images, jis_codes, sheets = utils.decode_ETL_Btype(records)
+        assert list(sheets) == [1234, 1235]
+        assert list(jis_codes) == [0x3021, 0x4f53]
+        assert np.array_equal(images, (1 - pixels) * 255)
+        images, _, _ = utils.decode_ETL_Btype(records, white_background=False)
+        assert np.array_equal(images, pixels * 255)
+
+
+def test_decode_ETL2():
+    rng = np.random.RandomState(0)
+    levels = rng.randint(0, 64, (60, 60))
+    s = make_ETL2_record(123456, (0x123, 0xabc), levels)
+    assert len(s) == 2745
+    images, co59_codes, serials = utils.decode_ETL2(
+        np.frombuffer(s, dtype=np.uint8).reshape(1, 2745))
+    assert serials[0] == 123456
+    assert co59_codes[0] == (0x123 << 12) | 0xabc
+    assert np.array_equal(images[0], 255 - levels * 4)
+
+
+def test_read_ids_ETL(tmp_path):
+    # B-type: a dummy record, then records numbered from 1
+    path = str(tmp_path / 'ETL8B2C1')
+    pixels = np.zeros((63, 64), dtype=np.uint8)
+    with open(path, 'wb') as f:
+        f.write(bytes(512))
+        for sheet in (7, 7, 300):
+            f.write(make_Btype_record(sheet, 0x3021, pixels, 512))
+    serials, sheets = utils.read_ids_ETL({path: 3}, 'B8')
+    assert list(serials) == [1, 2, 3]
+    assert list(sheets) == [7, 7, 300]
+
+    # ETL2: the serial data number doubles as the sheet number
+    path = str(tmp_path / 'ETL2_1')
+    with open(path, 'wb') as f:
+        for serial in (1, 4095, 987654):
+            f.write(make_ETL2_record(serial, (0, 0), np.zeros((60, 60), dtype=np.int64)))
+    serials, sheets = utils.read_ids_ETL({path: 3}, 'ETL2')
+    assert list(serials) == [1, 4095, 987654]
+    assert list(sheets) == [1, 4095, 987654]
+
+    # C-type: 36 bit serial data and sheet numbers at the head of the record
+    path = str(tmp_path / 'ETL3C_1')
+    with open(path, 'wb') as f:
+        for serial, sheet in ((5, 1), (2 ** 35 + 3, 2 ** 33 + 9)):
+            header = pack_bits([serial, sheet], 36)
+            f.write(header + bytes(2952 - len(header)))
+    serials, sheets = utils.read_ids_ETL({path: 2}, 'C')
+    assert list(serials) == [5, 2 ** 35 + 3]
+    assert list(sheets) == [1, 2 ** 33 + 9]
+
+    # M and G types: byte aligned fields of ETL_HEADER_DTYPES
+    for record_type, rec_size, sheet_offset in (('M', 2052, 4), ('G', 8199, 0)):
+        path = str(tmp_path / record_type)
+        with open(path, 'wb') as f:
+            for serial, sheet in ((11, 2), (70000, 65535)):
+                record = bytearray(rec_size)
+                record[sheet_offset:sheet_offset + 2] = sheet.to_bytes(2, 'big')
+                record[12:16] = serial.to_bytes(4, 'big')
+                f.write(bytes(record))
+        serials, sheets = utils.read_ids_ETL({path: 2}, record_type)
+        assert list(serials) == [11, 70000]
+        assert list(sheets) == [2, 65535]